@@ -1,31 +1,54 @@
 import os
+import sys
 import re
 import sqlite3
 import uuid
 import traceback
 import json
 import secrets
+import itertools
+import concurrent.futures
+import threading
+import weakref
+from collections import OrderedDict
 from functools import wraps
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask import (
     Flask, render_template, request, Response, jsonify,
-    send_from_directory, session, redirect, url_for, g, flash
+    send_from_directory, session, redirect, url_for, g, flash, stream_with_context
 )
 import ollama
-import pypdf
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
 
 # --- Configuration and Model Loading ---
 def load_json_file(filename, error_msg):
     try:
-        with open(filename, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
+        with open(filename, 'rb') as f:
+            return json_loads(f.read())
+    except (FileNotFoundError, json.JSONDecodeError):  # orjson.JSONDecodeError subclasses this
         print(f"FATAL: {error_msg}. Please run setup.py or get_models.py.")
-        exit()
+        sys.exit(1)
 
 CONFIG = load_json_file('config.json', 'config.json not found or is corrupt')
 MODELS = load_json_file('models.json', 'models.json not found or is corrupt')
+# Per-role model lists are fixed for the process lifetime (models.json is never reloaded).
+RESTRICTED_KEYWORDS = tuple(CONFIG.get('ollama_config', {}).get('restricted_keywords', []))
+ALLOWED_MODELS_USER = [m for m in MODELS if not any(k in m.get('name', '') for k in RESTRICTED_KEYWORDS)]
+
+# Werkzeug hash method, e.g. 'pbkdf2:sha256:200000'; falls back to Werkzeug's default when unset.
+PASSWORD_HASH_METHOD = CONFIG.get('security', {}).get('password_hash')
+# hashlib releases the GIL while hashing, so a CPU-sized pool lets a burst of signups
+# use every core without more hashes in flight than there are cores.
+HASH_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count())
+
+def hash_password(password):
+    if PASSWORD_HASH_METHOD: return HASH_POOL.submit(generate_password_hash, password, method=PASSWORD_HASH_METHOD).result()
+    return HASH_POOL.submit(generate_password_hash, password).result()
 
 app = Flask(__name__)
 app.secret_key = CONFIG.get('flask_secret_key')
@@ -40,14 +63,112 @@ SECURITY_DB_PATH = os.path.join(DATABASE_DIR, 'security.db')
 ADMIN_DB_PATH = os.path.join(DATABASE_DIR, 'admin.db')
 UPLOAD_FOLDER = 'uploads'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-ALLOWED_TEXT_EXTENSIONS = {'txt', 'md', 'py', 'csv', 'html', 'css', 'js'}
-ALLOWED_PDF_EXTENSIONS = {'pdf'}
-ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+ALLOWED_TEXT_EXTENSIONS = frozenset({'txt', 'md', 'py', 'csv', 'html', 'css', 'js'})
+ALLOWED_PDF_EXTENSIONS = frozenset({'pdf'})
+ALLOWED_IMAGE_EXTENSIONS = frozenset({'png', 'jpg', 'jpeg', 'gif'})
+SCHEMA_FILES = ('schema_chat.sql', 'schema_login.sql', 'schema_logs.sql', 'schema_security.sql', 'schema_admin.sql')
+
+def read_schema(name):
+    with open(os.path.join(DATABASE_DIR, name), 'r') as f:
+        return f.read()
+SCHEMAS = {name: read_schema(name) for name in SCHEMA_FILES}
+PWD_RE = re.compile(r'^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&])[A-Za-z\d@$!%*?&]{8,}$')
+
+# --- Hot-Path SQL (module constants so sqlite3's statement cache always hits) ---
+SQL_INSERT_MESSAGE = "INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)"
+SQL_SELECT_HISTORY = "SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY timestamp ASC, id ASC"
+SQL_SELECT_CONVERSATIONS = "SELECT id, title FROM conversations ORDER BY created_at DESC"
+SQL_SELECT_USER_BY_USERNAME = "SELECT id, username, password, role, chat_db_uuid FROM users WHERE username = ?"
+SQL_SELECT_CHAT_DB_UUID = "SELECT chat_db_uuid FROM users WHERE id = ?"
+
+def uuid_str(value):
+    # chat_db_uuid is a 16-byte BLOB for new users and dashed TEXT for older rows;
+    # both map to the same dashed form used for chat DB filenames and log columns.
+    return str(uuid.UUID(bytes=value)) if isinstance(value, bytes) else value
+
+# --- Conversation Caches (LRUs keyed by (user_id, conversation_id)) ---
+# CONVO_CACHE holds the write-through message history; CONVO_CONTEXT holds
+# (model, context tokens) from ollama.generate so a turn need not re-encode the history.
+CONVO_CACHE_SIZE = 256
+CONVO_CACHE = OrderedDict()
+CONVO_CONTEXT = OrderedDict()
+CONVO_CACHE_LOCK = threading.Lock()
+
+def lru_get(cache, key):
+    with CONVO_CACHE_LOCK:
+        value = cache.get(key)
+        if value is not None: cache.move_to_end(key)
+        return value
+def _lru_store(cache, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > CONVO_CACHE_SIZE: cache.popitem(last=False)
+def convo_cache_invalidate(key):
+    with CONVO_CACHE_LOCK:
+        CONVO_CACHE.pop(key, None)
+        CONVO_CONTEXT.pop(key, None)
+def convo_cache_commit(key, started_from, history, model, context, reread):
+    """Stores a finished turn. If another request wrote to the conversation since this one read
+    `started_from`, the history is reloaded with reread() and the model context is kept only if
+    nothing was missed; entries are swapped only if no one else updated them meanwhile."""
+    with CONVO_CACHE_LOCK:
+        current = CONVO_CACHE.get(key)
+        if current is started_from:
+            _lru_store(CONVO_CACHE, key, history)
+            # A turn without fresh context leaves any older context stale, so drop it.
+            if context: _lru_store(CONVO_CONTEXT, key, (model, context))
+            else: CONVO_CONTEXT.pop(key, None)
+            return
+    fresh = reread()
+    with CONVO_CACHE_LOCK:
+        if CONVO_CACHE.get(key) is not current:
+            CONVO_CACHE.pop(key, None)
+            CONVO_CONTEXT.pop(key, None)
+            return
+        _lru_store(CONVO_CACHE, key, fresh)
+        if context and fresh == history: _lru_store(CONVO_CONTEXT, key, (model, context))
+        else: CONVO_CONTEXT.pop(key, None)
 
 # --- Database Connection Logic ---
+def apply_pragmas(db, db_path):
+    # WAL lets readers run alongside the /ask writer; NORMAL sync is safe under WAL.
+    if db_path != ':memory:': db.execute('PRAGMA journal_mode=WAL;')
+    db.execute('PRAGMA synchronous=NORMAL;')
+    db.execute('PRAGMA busy_timeout=5000;')
+    db.execute('PRAGMA temp_store=MEMORY;')
+    db.execute('PRAGMA cache_size=-20000;')
+
+# Connections are pooled per worker thread and reused across requests. Each thread keeps
+# at most DB_POOL_SIZE connections (LRU, evicted ones are closed) and its pool is closed
+# when the thread exits, so a thread-per-request server or many user chat DBs can't leak.
+DB_POOL_SIZE = 8
+DB_POOL = threading.local()
+CHAT_DBS_READY = set()
+
+def close_connections(connections):
+    while connections:
+        try: connections.popitem()[1].close()
+        except sqlite3.Error: pass
+class ThreadDBPool:
+    """Per-thread LRU of open SQLite connections."""
+    def __init__(self):
+        self.connections = OrderedDict()
+        weakref.finalize(self, close_connections, self.connections)
+
 def get_db(db_path, row_factory=False):
-    db = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
-    if row_factory: db.row_factory = sqlite3.Row
+    pool = getattr(DB_POOL, 'pool', None)
+    if pool is None: pool = DB_POOL.pool = ThreadDBPool()
+    connections = pool.connections
+    db = connections.get(db_path)
+    if db is None:
+        db = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES, cached_statements=512, check_same_thread=False)
+        apply_pragmas(db, db_path)
+        connections[db_path] = db
+        while len(connections) > DB_POOL_SIZE:
+            try: connections.popitem(last=False)[1].close()
+            except sqlite3.Error: pass
+    else: connections.move_to_end(db_path)
+    db.row_factory = sqlite3.Row if row_factory else None
     return db
 def get_user_db():
     if 'user_db' not in g: g.user_db = get_db(USER_DB_PATH, True)
@@ -55,13 +176,17 @@ def get_user_db():
 def get_chat_db():
     if 'user_id' not in session: return None
     if 'chat_db' not in g:
-        user_db = get_user_db()
-        user = user_db.execute('SELECT chat_db_uuid FROM users WHERE id = ?', (session['user_id'],)).fetchone()
-        if not user: raise ValueError("User not found.")
-        path = os.path.join(CHAT_DB_DIR, f"{user['chat_db_uuid']}.db")
-        if not os.path.exists(path):
+        if 'chat_db_uuid' not in session:
+            # Sessions that predate caching the uuid at login: look it up once and keep it.
+            user = get_user_db().execute(SQL_SELECT_CHAT_DB_UUID, (session['user_id'],)).fetchone()
+            if not user: raise ValueError("User not found.")
+            session['chat_db_uuid'] = uuid_str(user['chat_db_uuid'])
+        path = os.path.join(CHAT_DB_DIR, f"{session['chat_db_uuid']}.db")
+        if path not in CHAT_DBS_READY:
+            # schema_chat.sql is idempotent, so this also migrates existing DBs (e.g. new indexes).
             with app.app_context():
                 init_db_on_startup(path, 'schema_chat.sql')
+            CHAT_DBS_READY.add(path)
         g.chat_db = get_db(path, True)
     return g.chat_db
 def get_logs_db():
@@ -78,7 +203,12 @@ def get_admin_db():
 def close_dbs(e=None):
     for attr in ['user_db', 'chat_db', 'logs_db', 'security_db', 'admin_db']:
         db = g.pop(attr, None)
-        if db: db.close()
+        if db:
+            # Pooled connections stay open; just leave them clean for the next request.
+            try:
+                if db.in_transaction: db.rollback()
+                db.execute('PRAGMA optimize')
+            except sqlite3.Error: pass
 
 # --- Decorators & Error Handlers ---
 def login_required(view):
@@ -96,23 +226,27 @@ def admin_required(view):
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('404.html'), 404
-@app.errorhandler(500)
-def internal_error(error):
+def log_error(error_trace, status_code=500):
+    """Writes an error_logs row for the current request; never raises."""
     try:
         logs_db = get_logs_db()
-        user_uuid = None
-        if 'user_id' in session:
+        user_uuid = session.get('chat_db_uuid')
+        if user_uuid is None and 'user_id' in session:
             user_db = get_user_db()
             if user_db:
-                user_info = user_db.execute('SELECT chat_db_uuid FROM users WHERE id = ?', (session['user_id'],)).fetchone()
-                if user_info: user_uuid = user_info['chat_db_uuid']
-        error_trace = traceback.format_exc()
+                user_info = user_db.execute(SQL_SELECT_CHAT_DB_UUID, (session['user_id'],)).fetchone()
+                if user_info: user_uuid = uuid_str(user_info['chat_db_uuid'])
         if logs_db:
-            logs_db.execute("INSERT INTO error_logs (user_uuid, request_method, request_url, ip_address, status_code, error_message) VALUES (?, ?, ?, ?, ?, ?)", (user_uuid, request.method, request.url, request.remote_addr, 500, error_trace))
+            logs_db.execute("INSERT INTO error_logs (user_uuid, request_method, request_url, ip_address, status_code, error_message) VALUES (?, ?, ?, ?, ?, ?)", (user_uuid, request.method, request.url, request.remote_addr, status_code, error_trace))
             logs_db.commit()
     except Exception as e:
         print(f"CRITICAL: Failed to log error to database: {e}")
-    return render_template('500.html', error_details=traceback.format_exc() if app.debug else None), 500
+
+@app.errorhandler(500)
+def internal_error(error):
+    error_trace = traceback.format_exc()
+    log_error(error_trace)
+    return render_template('500.html', error_details=error_trace if app.debug else None), 500
 
 # --- Routes ---
 @app.route('/')
@@ -126,7 +260,7 @@ def signup():
             db = get_user_db()
             db.execute(
                 'INSERT INTO users (username, password, email, chat_db_uuid, role, phone, birthday, city, country) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
-                (request.form['username'], generate_password_hash(request.form['password']), request.form['email'], str(uuid.uuid4()), 'user', request.form.get('phone'), request.form.get('birthday'), request.form.get('city'), request.form.get('country'))
+                (request.form['username'], hash_password(request.form['password']), request.form['email'], uuid.uuid4().bytes, 'user', request.form.get('phone'), request.form.get('birthday'), request.form.get('city'), request.form.get('country'))
             )
             db.commit()
             flash('Account created successfully! Please log in.', 'success')
@@ -143,16 +277,17 @@ def login():
     if request.method == 'POST':
         try:
             db = get_user_db()
-            user = db.execute('SELECT * FROM users WHERE username = ?', (request.form['username'],)).fetchone()
+            user = db.execute(SQL_SELECT_USER_BY_USERNAME, (request.form['username'],)).fetchone()
             if user and check_password_hash(user['password'], request.form['password']):
                 session.clear()
                 session['user_id'] = user['id']
                 session['username'] = user['username']
                 session['role'] = user['role']
+                session['chat_db_uuid'] = uuid_str(user['chat_db_uuid'])
                 session['selected_model'] = CONFIG.get('ollama_config', {}).get('default_model', '')
                 
                 security_db = get_security_db()
-                security_db.execute("INSERT INTO login_history (user_uuid, ip_address, user_agent) VALUES (?, ?, ?)",(user['chat_db_uuid'], request.remote_addr, request.headers.get('User-Agent')))
+                security_db.execute("INSERT INTO login_history (user_uuid, ip_address, user_agent) VALUES (?, ?, ?)",(session['chat_db_uuid'], request.remote_addr, request.headers.get('User-Agent')))
                 security_db.commit()
                 return redirect(url_for('main_chat_redirect'))
             flash('Invalid username or password.', 'error')
@@ -194,6 +329,7 @@ def new_chat():
         new_convo_id = str(uuid.uuid4())
         chat_db.execute("INSERT INTO conversations (id, title) VALUES (?, ?)", (new_convo_id, "New Chat"))
         chat_db.commit()
+        convo_cache_invalidate((session['user_id'], new_convo_id))
         return redirect(url_for('main_chat', conversation_id=new_convo_id))
     except Exception:
         raise
@@ -203,25 +339,26 @@ def new_chat():
 def profile():
     try:
         user_db = get_user_db()
-        user_data = user_db.execute("SELECT * FROM users WHERE id = ?", (session['user_id'],)).fetchone()
         if request.method == 'POST':
             form_name = request.form.get('form_name')
             if form_name == 'update_info':
                 user_db.execute("UPDATE users SET phone = ?, birthday = ?, city = ?, country = ? WHERE id = ?", (request.form.get('phone'), request.form.get('birthday'), request.form.get('city'), request.form.get('country'), session['user_id']))
                 flash('Profile information updated successfully!', 'success')
             elif form_name == 'change_password':
+                user_data = user_db.execute("SELECT password FROM users WHERE id = ?", (session['user_id'],)).fetchone()
                 if not check_password_hash(user_data['password'], request.form['current_password']):
                     flash('Incorrect current password.', 'error')
                 elif request.form['new_password'] != request.form['confirm_password']:
                     flash('New passwords do not match.', 'error')
-                elif not re.fullmatch(r'^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&])[A-Za-z\d@$!%*?&]{8,}$', request.form['new_password']):
+                elif not PWD_RE.fullmatch(request.form['new_password']):
                     flash('Password does not meet complexity requirements.', 'error')
                 else:
-                    new_hashed_password = generate_password_hash(request.form['new_password'])
+                    new_hashed_password = hash_password(request.form['new_password'])
                     user_db.execute("UPDATE users SET password = ? WHERE id = ?", (new_hashed_password, session['user_id']))
                     flash('Password changed successfully!', 'success')
             user_db.commit()
             return redirect(url_for('profile'))
+        user_data = user_db.execute("SELECT username, email, phone, birthday, city, country FROM users WHERE id = ?", (session['user_id'],)).fetchone()
         return render_template('profile.html', user=user_data)
     except Exception:
         raise
@@ -269,13 +406,7 @@ def settings():
 @login_required
 def get_models():
     try:
-        user_role = session.get('role', 'user')
-        if user_role == 'admin':
-            allowed_models = MODELS
-        else:
-            restricted = CONFIG.get('ollama_config', {}).get('restricted_keywords', [])
-            allowed_models = [m for m in MODELS if not any(k in m.get('name', '') for k in restricted)]
-        
+        allowed_models = MODELS if session.get('role', 'user') == 'admin' else ALLOWED_MODELS_USER
         return jsonify({
             "models": allowed_models,
             "default_model": session.get('selected_model')
@@ -306,7 +437,7 @@ def load_model():
 def get_conversations():
     try:
         chat_db = get_chat_db()
-        convos = chat_db.execute('SELECT id, title FROM conversations ORDER BY created_at DESC').fetchall()
+        convos = chat_db.execute(SQL_SELECT_CONVERSATIONS).fetchall()
         return jsonify([dict(row) for row in convos])
     except Exception:
         raise
@@ -316,7 +447,7 @@ def get_conversations():
 def get_conversation_messages(conversation_id):
     try:
         chat_db = get_chat_db()
-        messages = chat_db.execute('SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY timestamp ASC', (conversation_id,)).fetchall()
+        messages = chat_db.execute(SQL_SELECT_HISTORY, (conversation_id,)).fetchall()
         return jsonify([dict(row) for row in messages])
     except Exception:
         raise
@@ -336,37 +467,83 @@ def ask():
             return Response(f"Error: Missing required data. Details: {error_details}", status=400)
 
         chat_db = get_chat_db()
-        chat_db.execute("INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)", (conversation_id, 'user', user_message))
-        chat_db.commit()
-
-        history_rows = chat_db.execute("SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY timestamp ASC", (conversation_id,)).fetchall()
-        conversation_history = [dict(row) for row in history_rows]
+        cache_key = (session['user_id'], conversation_id)
+        cached_history = lru_get(CONVO_CACHE, cache_key)
+        if cached_history is None:
+            history_rows = chat_db.execute(SQL_SELECT_HISTORY, (conversation_id,)).fetchall()
+            cached_history = [dict(row) for row in history_rows]
+        conversation_history = cached_history + [{'role': 'user', 'content': user_message}]
         
-        stream = ollama.chat(model=model, messages=conversation_history, stream=True)
-        
-        ai_full_response = "".join(chunk['message']['content'] for chunk in stream)
+        # Continue from the model's own context tokens when we have them (or the chat is new);
+        # otherwise fall back to replaying the full history through ollama.chat.
+        cached_context = lru_get(CONVO_CONTEXT, cache_key)
+        context = cached_context[1] if cached_context and cached_context[0] == model else None
+        use_context = context is not None or len(conversation_history) == 1
+        # The stream is lazy: pull the first chunk here so connection and model errors still
+        # reach the 500 handler instead of breaking the body after the headers are sent.
+        try:
+            if use_context:
+                stream = ollama.generate(model=model, prompt=user_message, context=context, stream=True)
+            else:
+                stream = ollama.chat(model=model, messages=conversation_history, stream=True)
+            stream = iter(stream)
+            first_chunk = next(stream, None)
+        except Exception:
+            with chat_db:
+                chat_db.execute(SQL_INSERT_MESSAGE, (conversation_id, 'user', user_message))
+            convo_cache_invalidate(cache_key)
+            raise
         
-        if ai_full_response:
-            chat_db.execute("INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)", (conversation_id, 'assistant', ai_full_response))
-            chat_db.commit()
-            
         def generate():
-            yield re.sub(r'(\d*\.?\s?)\*\*(.*?)\*\*', r'<h2>\1\2</h2>', ai_full_response)
+            # Forward each token as it arrives; both turns are persisted in one transaction
+            # once the stream ends. The user turn is still saved if the stream fails.
+            buf = []
+            new_context = None
+            completed = False
+            rows = [(conversation_id, 'user', user_message)]
+            try:
+                for chunk in itertools.chain((first_chunk,) if first_chunk is not None else (), stream):
+                    if use_context:
+                        piece = chunk['response']
+                        if chunk.get('context'): new_context = chunk['context']
+                    else:
+                        piece = chunk['message']['content']
+                    if piece:
+                        buf.append(piece)
+                        yield piece
+                completed = True
+            except Exception:
+                log_error(traceback.format_exc())
+                yield "\n\nError: The model stopped responding. Your message was saved."
+            finally:
+                ai_full_response = "".join(buf)
+                if completed and ai_full_response:
+                    rows.append((conversation_id, 'assistant', ai_full_response))
+                with chat_db:
+                    chat_db.execute('BEGIN IMMEDIATE')
+                    chat_db.executemany(SQL_INSERT_MESSAGE, rows)
+                if not completed: convo_cache_invalidate(cache_key)
+            if not completed: return
+            if ai_full_response:
+                conversation_history.append({'role': 'assistant', 'content': ai_full_response})
+            # Another tab may have finished a turn in this conversation while this one streamed.
+            convo_cache_commit(cache_key, cached_history, conversation_history, model, new_context,
+                               lambda: [dict(row) for row in chat_db.execute(SQL_SELECT_HISTORY, (conversation_id,))])
             
-        return Response(generate(), mimetype='text/html')
+        return Response(stream_with_context(generate()), mimetype='text/plain', headers={'X-Accel-Buffering': 'no'})
     except Exception:
         raise
 
 # --- Initialization Function (for startup only) ---
-def init_db_on_startup(db_path, schema_path_relative):
-    schema_path = os.path.join(DATABASE_DIR, schema_path_relative)
+def init_db_on_startup(db_path, schema_key):
     try:
         con = sqlite3.connect(db_path)
-        with open(schema_path, 'r') as f:
-            con.cursor().executescript(f.read())
+        apply_pragmas(con, db_path)
+        con.executescript(SCHEMAS[schema_key])
         con.commit()
+        con.execute('PRAGMA optimize')
         con.close()
-        print(f"Initialized database at {db_path} from {schema_path_relative}.")
+        print(f"Initialized database at {db_path} from {schema_key}.")
     except Exception as e:
         print(f"Error initializing database {db_path}: {e}")
 
@@ -15,4 +15,9 @@ CREATE TABLE IF NOT EXISTS messages (
     content TEXT NOT NULL,
     timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (conversation_id) REFERENCES conversations (id)
-);
\ No newline at end of file
+);
+
+-- Indexes for the hot chat queries (history replay and sidebar listing).
+-- The implicit trailing rowid (id) also covers the history tiebreaker: ORDER BY timestamp, id.
+CREATE INDEX IF NOT EXISTS idx_msgs_convo_ts ON messages (conversation_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_convo_created ON conversations (created_at DESC);
\ No newline at end of file
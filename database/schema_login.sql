@@ -4,7 +4,7 @@ CREATE TABLE users (
     username TEXT UNIQUE NOT NULL,
     password TEXT NOT NULL,
     email TEXT UNIQUE NOT NULL,
-    chat_db_uuid TEXT UNIQUE NOT NULL,
+    chat_db_uuid BLOB UNIQUE NOT NULL, -- uuid4().bytes (16 bytes), older rows may hold dashed TEXT
     role TEXT NOT NULL DEFAULT 'user', -- New column for user roles
     phone TEXT,
     birthday TEXT,
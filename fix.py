@@ -65,10 +65,15 @@ def check_schemas(results):
             try:
                 cursor.execute(f"PRAGMA table_info({table_name})")
                 actual_cols = {row[1]: (row[2], row[3]) for row in cursor.fetchall()}
-                for col, (col_type, notnull) in expected_cols.item():
-                    if col not in actual_cols or actual_cols[col][0] != col_type or actual_cols[col][1] != notnull:
-                         report["tables"].setdefault(table_name, []).append(f"Column '{col}' MISMATCH")
-            except: report["tables"].setdefault(table_name, []).append("MISSING or FAILED to read")
+            except sqlite3.OperationalError:
+                report["tables"].setdefault(table_name, []).append("FAILED to read")
+                continue
+            if not actual_cols:
+                report["tables"].setdefault(table_name, []).append("MISSING")
+                continue
+            for col, (col_type, notnull) in expected_cols.items():
+                if actual_cols.get(col) != (col_type, notnull):
+                    report["tables"].setdefault(table_name, []).append(f"Column '{col}' MISMATCH")
         if report["tables"]: report["status"] = "ERROR"
         results["schemas"].append(report)
         conn.close()
@@ -1,5 +1,4 @@
 import json
-import re
 import subprocess
 
 try:
@@ -43,9 +42,9 @@ def fetch_ollama_models():
         model_list = []
         if len(lines) > 1:
             for line in lines[1:]:  # Skip header
-                parts = re.split(r'\s{2,}', line)  # Split on 2 or more spaces
+                parts = line.split(None, 1)  # Model name is the first whitespace-delimited token
                 if parts:
-                    model_list.append({'name': parts[0].strip()})
+                    model_list.append({'name': parts[0]})
         
         if model_list:
             print(f"Success: Found {len(model_list)} models via the command line.")
@@ -64,9 +63,14 @@ def save_models_to_json(models):
     except Exception as e:
         print(f"Error: Could not write to models.json. {e}")
 
-if __name__ == '__main__':
+def collect_models():
+    """Fetches the installed models, saves them to models.json, and returns the list."""
     models = fetch_ollama_models()
     if models:
         save_models_to_json(models)
     else:
-        print("Final result: No Ollama models were found by any method.")
\ No newline at end of file
+        print("Final result: No Ollama models were found by any method.")
+    return models
+
+if __name__ == '__main__':
+    collect_models()
\ No newline at end of file
@@ -1,13 +1,36 @@
 import os
+import contextlib
+import glob
+import hashlib
 import sqlite3
+import struct
+import time
 import zipfile
+import zlib
 import getpass
+import mmap
 import json
 import secrets
+import threading
 import uuid
-import subprocess
-from datetime import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from werkzeug.security import generate_password_hash
+from get_models import collect_models
+try:
+    import orjson
+    json_dumps = lambda obj: orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+except ImportError:
+    json_dumps = lambda obj: json.dumps(obj, indent=2).encode()
+try:
+    import deflate  # libdeflate bindings: faster DEFLATE and PCLMULQDQ-accelerated CRC32
+    # The ZIP CRC must match zlib's bit for bit; check the standard check value once.
+    LIBDEFLATE_AVAILABLE = deflate.crc32(b'123456789') == zlib.crc32(b'123456789') == 0xCBF43926
+except ImportError:
+    LIBDEFLATE_AVAILABLE = False
+# Errors that mean a member is corrupt (as opposed to the check itself failing).
+_CORRUPT_ERRORS = (zipfile.BadZipFile, zlib.error) + ((deflate.DeflateError,) if LIBDEFLATE_AVAILABLE else ())
 
 # --- Configuration ---
 BACKUP_DIR = 'backup'
@@ -17,45 +40,290 @@ CONFIG_FILE = 'config.json'
 MODELS_FILE = 'models.json'
 USER_DB_PATH = os.path.join(DB_DIR, 'users.db')
 USER_SCHEMA_PATH = os.path.join(DB_DIR, 'schema_login.sql')
-FILE_EXTENSIONS_TO_BACKUP = ('.py', '.html', '.css', '.js', '.sql', '.db', '.json')
+# '.db-wal' holds commits not yet checkpointed into its '.db' (the '-shm' index is rebuilt by SQLite).
+FILE_EXTENSIONS_TO_BACKUP = ('.py', '.html', '.css', '.js', '.sql', '.db', '.db-wal', '.json')
+_EXT_SET = frozenset(FILE_EXTENSIONS_TO_BACKUP)
+# PBKDF2 rounds for password hashes; override per host (e.g. Raspberry Pi) via the environment.
+# The default matches security.password_hash in the tracked config.json.
+PBKDF2_DEFAULT_ITERATIONS = 200000
+def _pbkdf2_iterations():
+    value = os.environ.get('PBKDF2_ITERATIONS')
+    if value is None:
+        return PBKDF2_DEFAULT_ITERATIONS
+    try:
+        if int(value) > 0:
+            return int(value)
+    except ValueError:
+        pass
+    print(f"WARNING: Ignoring invalid PBKDF2_ITERATIONS={value!r}, using {PBKDF2_DEFAULT_ITERATIONS}.")
+    return PBKDF2_DEFAULT_ITERATIONS
+PBKDF2_ITERATIONS = _pbkdf2_iterations()
+PASSWORD_HASH_METHOD = f'pbkdf2:sha256:{PBKDF2_ITERATIONS}'
+
+def _scan(path):
+    """Recursively yields (path, stat) for backup candidates under path, skipping BACKUP_DIR and hidden dirs."""
+    # Globals and attributes are bound as locals: this loop runs once per directory entry.
+    ext_set, splitext, backup_dir = _EXT_SET, os.path.splitext, BACKUP_DIR
+    with os.scandir(path) as it:
+        for entry in it:
+            name = entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if name != backup_dir and name[:1] != '.':
+                    yield from _scan(entry.path)
+            elif splitext(name)[1] in ext_set:
+                try:
+                    yield entry.path, entry.stat()
+                except FileNotFoundError:  # dangling symlink
+                    pass
+
+def checkpoint_databases():
+    """Folds each database's WAL back into its .db so the backup and fingerprint see every commit.
+    A WAL that can't be fully checkpointed (e.g. the app is running) is backed up alongside its .db."""
+    for db_path in glob.glob(os.path.join(DB_DIR, '**', '*.db'), recursive=True):
+        try:
+            with contextlib.closing(sqlite3.connect(db_path)) as conn:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            print(f"   WARNING: Could not checkpoint '{db_path}'. {e}")
 
 def gather_files_to_backup():
-    """Walks through the project and collects all files that should be backed up."""
+    """Returns a lazy iterator of (path, stat) for all project files that should be backed up."""
     print("1. Gathering files for backup...")
-    file_paths = []
-    for root, dirs, files in os.walk('.'):
-        if BACKUP_DIR in dirs:
-            dirs.remove(BACKUP_DIR)
-        for file in files:
-            if file.endswith(FILE_EXTENSIONS_TO_BACKUP):
-                file_path = os.path.join(root, file)
-                file_paths.append(file_path)
-    print(f"   Found {len(file_paths)} files to back up.")
-    return file_paths
-
-def create_zip_archive(file_list):
-    """Creates a timestamped zip archive of the provided files."""
+    return _scan('.')
+
+# --- ZIP Writer ---
+ZIP_COMPRESS_LEVEL = 1  # Deflate-1: most of level 6's ratio on source code at a fraction of the CPU.
+ZIP_MAX_SIZE = 0xFFFFFFFF  # No ZIP64 support; larger members abort the backup.
+# Per-process reusable state: a pristine zlib deflater that is copied per member,
+# and a read buffer that grows for big files and halves after a streak of small ones.
+_PRISTINE_DEFLATER = zlib.compressobj(ZIP_COMPRESS_LEVEL, zlib.DEFLATED, -15)
+_READ_BUF_MIN = 1 << 20
+_read_buf = bytearray(_READ_BUF_MIN)
+_recent_sizes = deque(maxlen=8)
+
+def _deflate_raw(data):
+    """Compresses data to a raw DEFLATE stream, preferring libdeflate when installed."""
+    if LIBDEFLATE_AVAILABLE:
+        return deflate.deflate_compress(data, ZIP_COMPRESS_LEVEL)
+    compressor = _PRISTINE_DEFLATER.copy()
+    return compressor.compress(data) + compressor.flush()
+
+def _is_compressible(data, sample_size=1 << 16):
+    """Cheap level-1 trial on the first 64 KiB: worth deflating only if it shrinks by 10%+."""
+    sample = data[:sample_size]
+    return not sample or len(zlib.compress(sample, 1)) < 0.9 * len(sample)
+
+def _encode_member(data, sample_size=1 << 16):
+    """Returns (method, payload), storing data uncompressed when DEFLATE would not pay off."""
+    # A trial on a member no bigger than the sample would deflate it twice; the size check
+    # below already falls back to STORED when DEFLATE doesn't help.
+    if len(data) <= sample_size or _is_compressible(data, sample_size):
+        payload = _deflate_raw(data)
+        if len(payload) < len(data):
+            return zipfile.ZIP_DEFLATED, payload
+    return zipfile.ZIP_STORED, bytes(data)
+
+def _read_file(f, size):
+    """Reads up to size bytes of f into the shared buffer and returns a view of them."""
+    global _read_buf
+    _recent_sizes.append(size)
+    if size > len(_read_buf):
+        _read_buf = bytearray(size)
+    elif (len(_read_buf) > _READ_BUF_MIN and len(_recent_sizes) == _recent_sizes.maxlen
+          and max(_recent_sizes) < len(_read_buf) // 4):
+        _read_buf = bytearray(max(len(_read_buf) // 2, _READ_BUF_MIN))
+    view = memoryview(_read_buf)[:size]
+    return view[:f.readinto(view)]
+
+def _stream_member(f):
+    """Compresses f in 1 MiB chunks, updating the CRC in the same pass over each chunk."""
+    compressor = _PRISTINE_DEFLATER.copy()
+    crc, usize, parts = 0, 0, []
+    while chunk := f.read(_READ_BUF_MIN):
+        crc = _crc32(chunk, crc)
+        usize += len(chunk)
+        parts.append(compressor.compress(chunk))
+    parts.append(compressor.flush())
+    return zipfile.ZIP_DEFLATED, b''.join(parts), crc, usize
+
+def _crc32(data, value=0):
+    return deflate.crc32(data, value) if LIBDEFLATE_AVAILABLE else zlib.crc32(data, value)
+
+def _dos_datetime(mtime):
+    """Converts a POSIX mtime into the (time, date) pair stored in ZIP headers."""
+    t = time.localtime(max(mtime, 315532800))  # ZIP dates start at 1980-01-01
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+def _compress_one(item):
+    """Worker: reads and compresses one (path, stat) item, returning everything its ZIP headers need."""
+    path, st = item
+    if st.st_size >= ZIP_MAX_SIZE:
+        raise ValueError(f"'{path}' is too large for a non-ZIP64 archive.")
+    with open(path, 'rb', buffering=_READ_BUF_MIN) as f:
+        if st.st_size >= _READ_BUF_MIN:
+            # Large files (e.g. .db) are mapped and compressed in place: no read() copy.
+            # If the file can't be mapped, stream it with 1 MiB reads instead of 8 KiB ones.
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                return (path, *_stream_member(f), st.st_mtime, st.st_mode)
+            with mm, memoryview(mm) as data:
+                return (path, *_encode_member(data), _crc32(data), len(data), st.st_mtime, st.st_mode)
+        data = _read_file(f, st.st_size)
+    return (path, *_encode_member(data), _crc32(data), len(data), st.st_mtime, st.st_mode)
+
+# At most this many members are queued in the worker pool, so compressed payloads
+# waiting to be written stay bounded however large the tree is.
+ZIP_MAX_IN_FLIGHT = 2 * (os.cpu_count() or 1)
+# Members this large are compressed in the parent (mmap, no pickling through the pipe).
+ZIP_PARENT_MIN = 8 << 20
+
+def _compressed_members(pool, files):
+    """Yields _compress_one() results in input order, keeping a bounded window of in-flight futures."""
+    pending = deque()
+    for item in files:
+        if item[1].st_size >= ZIP_PARENT_MIN:
+            while pending:
+                yield pending.popleft().result()
+            yield _compress_one(item)
+            continue
+        pending.append(pool.submit(_compress_one, item))
+        if len(pending) >= ZIP_MAX_IN_FLIGHT:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def _write_zip(zip_filepath, files, comment=b''):
+    """Writes the (path, stat) iterable into a ZIP (DEFLATE or STORED per member), building the headers by hand.
+    Small members are compressed in parallel worker processes, large ones in this process;
+    all are written in input order.
+    Returns the number of members written."""
+    # Central directory records are packed straight into one growing buffer and written once.
+    central_dir = bytearray()
+    count = 0
+    with open(zip_filepath, 'wb') as out, ProcessPoolExecutor() as pool:
+        for path, method, payload, crc, usize, mtime, mode in _compressed_members(pool, files):
+            if out.tell() >= ZIP_MAX_SIZE:
+                raise ValueError("Archive is too large for a non-ZIP64 archive.")
+            arcname = os.path.normpath(path).lstrip(os.sep).replace(os.sep, '/').encode('utf-8')
+            dos_time, dos_date = _dos_datetime(mtime)
+            offset = out.tell()
+            out.write(struct.pack('<IHHHHHIIIHH', 0x04034b50, 20, 0x800, method,
+                                  dos_time, dos_date, crc, len(payload), usize, len(arcname), 0))
+            out.write(arcname)
+            out.write(payload)
+            central_dir += struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | 20, 20, 0x800,
+                                       method, dos_time, dos_date, crc, len(payload),
+                                       usize, len(arcname), 0, 0, 0, 0,
+                                       (mode & 0xFFFF) << 16, offset)
+            central_dir += arcname
+            count += 1
+        cd_offset = out.tell()
+        out.write(central_dir)
+        out.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count,
+                              len(central_dir), cd_offset, len(comment)))
+        out.write(comment)
+    return count
+
+def _tree_fingerprint(snapshot):
+    """Hashes the (path, mtime, size) manifest of a snapshot; stored as the archive comment."""
+    digest = hashlib.blake2b()
+    for path, st in sorted(snapshot, key=lambda item: item[0]):
+        digest.update(f"{path}\0{st.st_mtime_ns}\0{st.st_size}\n".encode('utf-8', 'surrogateescape'))
+    return b'manifest-blake2b:' + digest.hexdigest().encode('ascii')
+
+def _latest_backup_fingerprint():
+    """Returns (path, fingerprint) of the newest backup archive, or (None, None)."""
+    archives = sorted(glob.glob(os.path.join(BACKUP_DIR, 'backup_*.zip')))
+    if not archives:
+        return None, None
+    try:
+        with zipfile.ZipFile(archives[-1], 'r') as zipf:
+            return archives[-1], zipf.comment
+    except (OSError, zipfile.BadZipFile):
+        return None, None
+
+def create_zip_archive(files, comment=b''):
+    """Creates a timestamped zip archive of the provided files (any iterable of (path, stat))."""
     os.makedirs(BACKUP_DIR, exist_ok=True)
-    timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    timestamp = time.strftime('%Y-%m-%d_%H-%M-%S')
     zip_filename = f'backup_{timestamp}.zip'
     zip_filepath = os.path.join(BACKUP_DIR, zip_filename)
     print(f"\n2. Creating archive: '{zip_filepath}'...")
     try:
-        with zipfile.ZipFile(zip_filepath, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for file in file_list:
-                zipf.write(file, arcname=file)
-        print("   Archive created successfully.")
+        count = _write_zip(zip_filepath, files, comment)
+        if not count:
+            os.remove(zip_filepath)
+            print("   No files found to back up.")
+            return None
+        print(f"   Archive created successfully with {count} files.")
         return zip_filepath
     except Exception as e:
         print(f"   ERROR: Failed to create zip file. {e}")
         return None
 
+def discard_archive(zip_filepath):
+    """Deletes an archive that failed verification so a later run can't reuse it."""
+    try:
+        os.remove(zip_filepath)
+        print(f"   - Deleted corrupt archive '{zip_filepath}'")
+    except OSError as e:
+        print(f"   ERROR: Could not delete '{zip_filepath}'. {e}")
+
+VERIFY_PARALLEL_MIN = 32 << 20  # below this much data a serial testzip() beats fanning out
+
+def _read_raw_member(f, lock, info):
+    """Returns a member's raw (still compressed) bytes via its local header, or None if the header is bad."""
+    with lock:
+        f.seek(info.header_offset)
+        header = f.read(30)
+        if len(header) != 30 or header[:4] != b'PK\x03\x04':
+            return None
+        name_len, extra_len = struct.unpack('<HH', header[26:30])
+        f.seek(name_len + extra_len, os.SEEK_CUR)
+        return f.read(info.compress_size)
+
+def _verify_batch(zipf, raw_f, lock, infos):
+    """Worker: returns the name of the first member in `infos` that fails to decompress or whose CRC mismatches, else None."""
+    for info in infos:
+        try:
+            if LIBDEFLATE_AVAILABLE and info.compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                raw = _read_raw_member(raw_f, lock, info)
+                if raw is None:
+                    return info.filename
+                data = deflate.deflate_decompress(raw, info.file_size) if info.compress_type == zipfile.ZIP_DEFLATED else raw
+                if len(data) != info.file_size or _crc32(data) != info.CRC:
+                    return info.filename
+            else:
+                # zipfile checks the CRC itself once a member has been read to the end.
+                with zipf.open(info) as member:
+                    while member.read(1 << 20):
+                        pass
+        except _CORRUPT_ERRORS:
+            return info.filename
+    return None
+
 def verify_zip_archive(zip_filepath):
-    """Performs an integrity check on the zip file to verify checksums."""
+    """Performs an integrity check on the zip file to verify checksums.
+    The central directory is parsed once; large archives are checked in one batch of
+    members per thread (zlib/libdeflate release the GIL), small ones with a serial testzip()."""
     print(f"\n3. Verifying archive integrity...")
     try:
-        with zipfile.ZipFile(zip_filepath, 'r') as zipf:
-            bad_file = zipf.testzip()
+        # zipfile never closes a file object it was handed, so worker threads can share it safely.
+        with open(zip_filepath, 'rb') as f, open(zip_filepath, 'rb') as raw_f, zipfile.ZipFile(f, 'r') as zipf:
+            infos = zipf.infolist()
+            if sum(info.file_size for info in infos) < VERIFY_PARALLEL_MIN:
+                bad_file = zipf.testzip()
+            else:
+                try:
+                    workers = os.cpu_count() or 1
+                    with ThreadPoolExecutor(max_workers=workers) as pool:
+                        batches = [infos[i::workers] for i in range(workers)]
+                        results = pool.map(partial(_verify_batch, zipf, raw_f, threading.Lock()), batches)
+                        bad_file = next((name for name in results if name), None)
+                except Exception:
+                    bad_file = zipf.testzip()
             if bad_file is None:
                 print("   Checksum OK. Archive is valid.")
                 return True
@@ -67,45 +335,37 @@ def verify_zip_archive(zip_filepath):
         return False
 
 def clear_all_databases_and_logs():
-    """Deletes all .db and log files to ensure a clean slate."""
+    """Deletes all .db (with their -wal/-shm sidecars) and log files to ensure a clean slate."""
     print("\n4. Clearing old databases and logs...")
     # Also clear the root-level models.json
-    if os.path.exists(MODELS_FILE):
+    with contextlib.suppress(FileNotFoundError):
         os.remove(MODELS_FILE)
         print(f"   - Deleted '{MODELS_FILE}'")
 
     for directory in [DB_DIR, LOGS_DIR]:
-        if not os.path.isdir(directory): continue
-        for item in os.listdir(directory):
-            if item.endswith(('.db', '.json')):
-                try:
-                    full_path = os.path.join(directory, item)
-                    if os.path.isfile(full_path):
-                        os.remove(full_path)
-                        print(f"   - Deleted '{full_path}'")
-                except Exception as e:
-                    print(f"   ERROR: Could not delete '{item}'. {e}")
+        try:
+            it = os.scandir(directory)
+        except FileNotFoundError:
+            continue
+        with it:
+            for entry in it:
+                # A leftover -wal would be replayed into the fresh DB created at the same path.
+                if entry.name.endswith(('.db', '.db-wal', '.db-shm', '.json')):
+                    try:
+                        if entry.is_file(follow_symlinks=False):
+                            os.remove(entry.path)
+                            print(f"   - Deleted '{entry.path}'")
+                    except Exception as e:
+                        print(f"   ERROR: Could not delete '{entry.name}'. {e}")
 
 def reset_config_and_create_admin():
     """Generates a config.json and creates the root admin."""
     print("\n5. Setting up initial configuration...")
 
-    # Run get_models.py to create models.json
-    try:
-        print("   - Running get_models.py to detect Ollama models...")
-        subprocess.run(['python', 'get_models.py'], check=True)
-    except (subprocess.CalledProcessError, FileNotFoundError) as e:
-        print(f"   - ERROR: Failed to run get_models.py. {e}")
-        return False
-
-    # Read models from models.json
-    available_models = []
-    try:
-        with open(MODELS_FILE, 'r') as f:
-            available_models = json.load(f)
-        print(f"   - Found {len(available_models)} models from {MODELS_FILE}.")
-    except (FileNotFoundError, json.JSONDecodeError):
-        print(f"   - WARNING: {MODELS_FILE} could not be read. No models will be available.")
+    # Detect Ollama models in-process; collect_models() also writes models.json
+    print("   - Detecting Ollama models...")
+    available_models = collect_models()
+    print(f"   - Found {len(available_models)} models.")
 
     # ** FIXED: Dynamically set the default model **
     default_model = ""
@@ -117,14 +377,15 @@ def reset_config_and_create_admin():
         print("   - WARNING: No models found, default model will be empty.")
     
     new_secret_key = secrets.token_hex(32)
-    admin_uuid = str(uuid.uuid4())
+    admin_uuid = uuid.uuid4()
     default_config = {
         "flask_secret_key": new_secret_key,
-        "root_admin_chat_db_uuid": admin_uuid,
+        "root_admin_chat_db_uuid": admin_uuid.hex,
         "ollama_config": {
             "default_model": default_model, # Use the dynamically found model
             "restricted_keywords": ["dolphin", "uncensored"],
         },
+        "security": { "password_hash": PASSWORD_HASH_METHOD },
         "server_config": { "host": "192.168.3.2", "port": 5000, "debug": True, "threaded": True }
     }
     
@@ -132,27 +393,38 @@ def reset_config_and_create_admin():
     prompt = f"Enter password for 'root' admin (or press Enter for default: {default_pass}): "
     password = getpass.getpass(prompt) or default_pass
     if password == default_pass: print("Used default password.")
-    hashed_password = generate_password_hash(password)
+    hashed_password = generate_password_hash(password, method=PASSWORD_HASH_METHOD)
 
     try:
         os.makedirs(DB_DIR, exist_ok=True)
-        conn = sqlite3.connect(USER_DB_PATH)
-        cursor = conn.cursor()
+        # Autocommit mode: the driver opens no implicit transactions, so the single
+        # BEGIN IMMEDIATE ... COMMIT below is the only one (executescript would commit mid-way).
+        conn = sqlite3.connect(USER_DB_PATH, isolation_level=None)
+        conn.executescript("PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; PRAGMA temp_store=MEMORY; PRAGMA cache_size=-65536;")
         with open(USER_SCHEMA_PATH, 'r') as f:
-            cursor.executescript(f.read())
-        cursor.execute(
-            "INSERT INTO users (id, username, password, email, chat_db_uuid, role) VALUES (?, ?, ?, ?, ?, ?)",
-            (1, 'root', hashed_password, 'admin@local.host', admin_uuid, 'admin')
-        )
-        conn.commit()
-        conn.close()
+            statements = [stmt.strip() for stmt in f.read().split(';') if stmt.strip()]
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            for stmt in statements:
+                cursor.execute(stmt)
+            cursor.executemany(
+                "INSERT INTO users (id, username, password, email, chat_db_uuid, role) VALUES (?, ?, ?, ?, ?, ?)",
+                [(1, 'root', hashed_password, 'admin@local.host', admin_uuid.bytes, 'admin')]
+            )
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
         print("   - Root admin 'root' created successfully in users.db.")
     except Exception as e:
         print(f"   ERROR: Failed to create root admin. {e}")
         return False
     try:
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(default_config, f, indent=4)
+        with open(CONFIG_FILE, 'wb') as f:
+            f.write(json_dumps(default_config))
         print(f"   - Default '{CONFIG_FILE}' created successfully.")
     except Exception as e:
         print(f"   ERROR: Failed to create {CONFIG_FILE}. {e}")
@@ -165,13 +437,28 @@ def main():
     """Main function to run the backup and cleanup process."""
     print("--- Starting Project Backup & Setup Script ---")
     
-    files_to_backup = gather_files_to_backup()
-    if not files_to_backup:
+    checkpoint_databases()
+    # The manifest needs the whole tree before deciding, so the scan is materialized here.
+    snapshot = list(gather_files_to_backup())
+    if not snapshot:
         print("No files found to back up. Exiting.")
         return
 
-    archive_path = create_zip_archive(files_to_backup)
-    if not archive_path or not verify_zip_archive(archive_path):
+    fingerprint = _tree_fingerprint(snapshot)
+    latest_path, latest_fingerprint = _latest_backup_fingerprint()
+    archive_path = None
+    if latest_fingerprint == fingerprint:
+        print(f"\n2. No changes since '{latest_path}'. Reusing it as the backup.")
+        if verify_zip_archive(latest_path):
+            archive_path = latest_path
+        else:
+            discard_archive(latest_path)
+    if archive_path is None:
+        archive_path = create_zip_archive(snapshot, comment=fingerprint)
+        if archive_path and not verify_zip_archive(archive_path):
+            discard_archive(archive_path)
+            archive_path = None
+    if not archive_path:
         print("\n--- Process Aborted! ---")
         print("Backup creation or verification failed. No files were deleted.")
         return
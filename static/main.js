@@ -12,6 +12,8 @@ document.addEventListener('DOMContentLoaded', () => {
     const uploadButton = document.querySelector('#upload-form button');
 
     const currentConversationId = chatContainer ? chatContainer.dataset.conversationId : null;
+    const H2_RE = /(\d*\.?\s?)\*\*(.*?)\*\*/g;
+    const H2_SUB = '<h2>$1$2</h2>';
     let isModelLoading = false;
 
     // --- Helper function to add messages to the chat window ---
@@ -30,6 +32,11 @@ document.addEventListener('DOMContentLoaded', () => {
         return messageDiv;
     }
 
+    // --- Helper to turn **bold** lines in AI replies into headings ---
+    function formatAiResponse(text) {
+        return text.replace(H2_RE, H2_SUB);
+    }
+
     // --- Reusable function to handle the model loading sequence ---
     async function handleModelLoad(modelName) {
         if (!modelName || isModelLoading) {
@@ -132,7 +139,19 @@ document.addEventListener('DOMContentLoaded', () => {
                     const errorText = await response.text();
                     throw new Error(errorText || `HTTP error! status: ${response.status}`);
                 }
-                aiThinkingMessage.innerHTML = await response.text();
+                // Render tokens as they stream in; headings are formatted on the accumulated text.
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let aiFullResponse = '';
+                while (true) {
+                    const { done, value } = await reader.read();
+                    if (done) break;
+                    aiFullResponse += decoder.decode(value, { stream: true });
+                    aiThinkingMessage.innerHTML = formatAiResponse(aiFullResponse);
+                    chatWindow.scrollTop = chatWindow.scrollHeight;
+                }
+                aiFullResponse += decoder.decode();
+                aiThinkingMessage.innerHTML = formatAiResponse(aiFullResponse);
             } catch (error) {
                 aiThinkingMessage.innerHTML = `<p class="error-message">${error.message}</p>`;
             }